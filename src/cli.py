@@ -2,6 +2,19 @@ import argparse
 import os
 from pathlib import Path
 
+DATA_DIR = '.data'
+# kept in sync with llm.EMBEDDING_BACKENDS and llm.GENERATIVE_BACKENDS, which are
+# not imported here so that --help does not load the models' dependencies
+EMBEDDING_BACKEND_CHOICES = ['ollama', 'sentence-transformers', 'hashing']
+GENERATIVE_BACKEND_CHOICES = ['ollama']
+EMBEDDING_BACKEND_HELP = (
+    'The backend that computes the embeddings (default: the one that built the index for '
+    'retrieval, otherwise $RAG_EMBEDDING_BACKEND, or \'ollama\')'
+)
+GENERATIVE_BACKEND_HELP = (
+    'The backend that runs the generative model (default: $RAG_GENERATIVE_BACKEND, or \'ollama\')'
+)
+
 class CLI:
     def __init__(self):
         self.parser = argparse.ArgumentParser(description='CLI for interacting with the local RAG (Retrieval-Augmented Generation).')
@@ -42,6 +55,13 @@ class CLI:
             default=150,
             help='The size of each text chunk'
         )
+        parser_split.add_argument(
+            '--embedding_backend',
+            type=str,
+            choices=EMBEDDING_BACKEND_CHOICES,
+            default=None,
+            help=EMBEDDING_BACKEND_HELP
+        )
         parser_split.set_defaults(func=self.cmd_split)
         
         # Retrieve CMD
@@ -65,6 +85,19 @@ class CLI:
             default=10,
             help='The number of retrieved text chunks'
         )
+        parser_retrieval.add_argument(
+            '--embedding_backend',
+            type=str,
+            choices=EMBEDDING_BACKEND_CHOICES,
+            default=None,
+            help=EMBEDDING_BACKEND_HELP
+        )
+        parser_retrieval.add_argument(
+            '--shards',
+            type=int,
+            default=None,
+            help='Search the index with this many worker-process shards instead of in memory'
+        )
         parser_retrieval.set_defaults(func=self.cmd_retrieve)
         
         # Ask CMD
@@ -88,7 +121,77 @@ class CLI:
             default=10,
             help='The number of retrieved text chunks'
         )
+        parser_ask.add_argument(
+            '--embedding_backend',
+            type=str,
+            choices=EMBEDDING_BACKEND_CHOICES,
+            default=None,
+            help=EMBEDDING_BACKEND_HELP
+        )
+        parser_ask.add_argument(
+            '--generative_backend',
+            type=str,
+            choices=GENERATIVE_BACKEND_CHOICES,
+            default=None,
+            help=GENERATIVE_BACKEND_HELP
+        )
+        parser_ask.add_argument(
+            '--shards',
+            type=int,
+            default=None,
+            help='Search the index with this many worker-process shards instead of in memory'
+        )
         parser_ask.set_defaults(func=self.cmd_ask)
+        
+        # Benchmark CMD
+        parser_benchmark = subparsers.add_parser(
+            'benchmark',
+            help='Measures sharded search throughput for several shard and worker counts'
+        )
+        parser_benchmark.add_argument(
+            'file_name',
+            type=str,
+            help='The file name in the .data directory'
+        )
+        parser_benchmark.add_argument(
+            '--shards',
+            type=int,
+            nargs='+',
+            default=[1, 2, 4, 8],
+            help='The shard counts to measure (default: 1 2 4 8)'
+        )
+        parser_benchmark.add_argument(
+            '--workers',
+            type=int,
+            nargs='+',
+            default=None,
+            help='The worker process counts to measure (default: one worker per shard)'
+        )
+        parser_benchmark.add_argument(
+            '--queries',
+            type=int,
+            default=100,
+            help='The number of random queries per configuration (default: 100)'
+        )
+        parser_benchmark.add_argument(
+            '--top_k',
+            type=int,
+            default=10,
+            help='The number of retrieved text chunks (default: 10)'
+        )
+        parser_benchmark.add_argument(
+            '--block_rows',
+            type=int,
+            default=4096,
+            help='The number of embedding rows scored per matrix product; shards are cut on these blocks (default: 4096)'
+        )
+        parser_benchmark.add_argument(
+            '--blas_threads',
+            type=int,
+            default=1,
+            help='The maximum number of BLAS threads per worker, applied with threadpoolctl (default: 1)'
+        )
+        parser_benchmark.set_defaults(func=self.cmd_benchmark)
     
     
     def run(self):
@@ -104,6 +207,9 @@ class CLI:
         print(f'Ingesting pdf file...')
         print(f'\t- file_name: {file_name}')
         print(f'\t- extraction_mode: {extraction_mode}')
+        rag = self._build_rag(args)
+        rag.ingest(extraction_mode)
+        print(f'Raw text saved to {rag.raw_text_path}')
         return
     
     
@@ -114,6 +220,10 @@ class CLI:
         print(f'Splitting raw text...')
         print(f'\t- file_name: {file_name}')
         print(f'\t- chunk_size: {chunk_size}')
+        print(f'\t- embedding_backend: {args.embedding_backend}')
+        rag = self._build_rag(args)
+        rag.split(minimum_chunk_length=chunk_size)
+        print(f'{len(rag.chunks)} chunks saved to {rag.chunks_path} and {rag.embeddings_path}')
         return
     
     
@@ -126,6 +236,12 @@ class CLI:
         print(f'\t- file_name: {file_name}')
         print(f'\t- query: {query}')
         print(f'\t- top_k: {top_k}')
+        print(f'\t- shards: {args.shards}')
+        print(f'\t- embedding_backend: {args.embedding_backend}')
+        rag = self._build_rag(args)
+        rag.retrieve(query, top_k=top_k, n_shards=args.shards)
+        for index, chunk in enumerate(rag.relevant_chunks):
+            print(f'- Chunk #{index + 1}: {chunk}')
         return
     
     
@@ -138,8 +254,61 @@ class CLI:
         print(f'\t- file_name: {file_name}')
         print(f'\t- query: {query}')
         print(f'\t- top_k: {top_k}')
+        print(f'\t- shards: {args.shards}')
+        print(f'\t- embedding_backend: {args.embedding_backend}')
+        print(f'\t- generative_backend: {args.generative_backend}')
+        from rag import DEFAULT_CONTEXT, DEFAULT_INSTRUCTIONS
+        
+        rag = self._build_rag(args)
+        rag.retrieve(query, top_k=top_k, n_shards=args.shards)
+        rag.prompt.set_context(DEFAULT_CONTEXT.format(file_name=file_name))
+        rag.prompt.set_instructions(DEFAULT_INSTRUCTIONS)
+        rag.prompt.set_chunks(rag.relevant_chunks)
+        rag.prompt.set_question(query)
+        rag.prompt.compile()
+        rag.ask_llm()
+        print(rag.answer)
         return
     
+    
+    def cmd_benchmark(self, args):
+        from retriever import benchmark_sharded_search
+        
+        file_name = args.file_name
+        chunks_path = os.path.join(DATA_DIR, file_name + '_chunks' + '.csv')
+        embeddings_path = os.path.join(DATA_DIR, file_name + '_embeddings' + '.npy')
+        
+        print(f'Benchmarking sharded search')
+        print(f'\t- file_name: {file_name}')
+        print(f'\t- shards: {args.shards}')
+        print(f'\t- workers: {args.workers}')
+        print(f'\t- cores: {os.cpu_count()}')
+        print(f'\t- blas_threads: {args.blas_threads}')
+        report = benchmark_sharded_search(
+            chunks_path=chunks_path,
+            chunks_embeddings_path=embeddings_path,
+            shard_counts=args.shards,
+            worker_counts=args.workers,
+            n_queries=args.queries,
+            top_k=args.top_k,
+            block_rows=args.block_rows,
+            blas_threads=args.blas_threads
+        )
+        print(report.to_string(index=False))
+        return
+    
+    
+    def _build_rag(self, args):
+        # imported here so that --help does not load the models' dependencies
+        from rag import RAG
+        
+        return RAG(
+            file_name=args.file_name,
+            dir_name=DATA_DIR,
+            embedding_backend=getattr(args, 'embedding_backend', None),
+            generative_backend=getattr(args, 'generative_backend', None)
+        )
+    
 
 def main():
     cli = CLI()
@@ -1,7 +1,8 @@
-from llm import EmbeddingModel
+from llm import EmbeddingModel, embeddings_metadata_path
 from pypdf import PdfReader
 import pandas as pd
 import numpy as np
+import json
 import os
 from typing import *
 
@@ -86,6 +87,7 @@ class ChunkingHandler:
         self.file_path = file_path
         self.chunks: List[str] = None
         self.chunk_embeddings: np.typing.ArrayLike = None
+        self.embedding_model: EmbeddingModel = None
         self.load_text()
         pass
     
@@ -122,14 +124,18 @@ class ChunkingHandler:
         return
     
     
-    def embed(self):
+    def embed(self, embedding_model: EmbeddingModel = None):
         """
-        Generate embeddings for the current text chunks using the default embedding model.
+        Generate embeddings for the current text chunks.
 
         This method uses the `EmbeddingModel` class to convert each chunk of text
         stored in `self.chunks` into a numerical vector representation and stores
         the result in `self.chunk_embeddings`.
 
+        Args:
+            embedding_model (EmbeddingModel, optional): The model used to embed the
+                chunks. Defaults to `EmbeddingModel()` with the configured backend.
+
         Examples:
             >>> handler = ChunkingHandler(file_path="output.txt")
             >>> handler.split()
@@ -137,8 +143,8 @@ class ChunkingHandler:
             >>> handler.embed()
             >>> print(handler.chunk_embeddings.shape)  # e.g., (num_chunks, embedding_dim)
         """
-        embedding_model = EmbeddingModel()
-        self.chunk_embeddings = embedding_model.embed(self.chunks)
+        self.embedding_model = embedding_model or EmbeddingModel()
+        self.chunk_embeddings = self.embedding_model.embed(self.chunks)
         return
     
 
@@ -193,6 +199,11 @@ class ChunkingHandler:
         """
         Save the generated embeddings to a file in NumPy `.npy` format.
 
+        The backend, model name and dimension that built them are written next
+        to it, in a `.json` file of the same name, so `Retriever` can refuse to
+        query them with a different embedding model. When the embeddings were not
+        built by `embed`, no such file is written and any previous one is removed.
+
         Args:
             path (os.path): Path where the embeddings file should be saved.
 
@@ -204,5 +215,13 @@ class ChunkingHandler:
             >>> handler.save_embeddings("embeddings.npy")
         """
         np.save(file=path, arr=self.chunk_embeddings)
+        metadata_path = embeddings_metadata_path(path)
+        if self.embedding_model is None:
+            if os.path.exists(metadata_path): os.remove(metadata_path)
+            return
+        metadata = self.embedding_model.describe()
+        metadata['dim'] = int(np.shape(self.chunk_embeddings)[1])
+        with open(metadata_path, 'w', encoding='utf-8') as file:
+            json.dump(metadata, file)
         return
     
\ No newline at end of file
@@ -1,18 +1,263 @@
-import ollama
 import numpy as np
+from abc import ABC, abstractmethod
+from functools import partial
+import hashlib
+import re
+import os
 from typing import *
 
 DEFAULT_EMBEDDING_MODEL_NAME = 'mxbai-embed-large'
 DEFAULT_GENERATIVE_MODEL_NAME = 'gemma3:4b'
+DEFAULT_SENTENCE_TRANSFORMERS_MODEL_NAME = 'all-MiniLM-L6-v2'
+DEFAULT_HASHING_EMBEDDING_DIM = 384
+DEFAULT_BACKEND = 'ollama'
+
+# Backends can be selected without code changes through these environment variables.
+BACKEND_ENVIRONMENT_VARIABLES = {
+    'embedding': 'RAG_EMBEDDING_BACKEND',
+    'generative': 'RAG_GENERATIVE_BACKEND',
+}
+
+
+class EmbeddingBackend(ABC):
+    """
+    Interface of the engines that turn text into vectors for `EmbeddingModel`.
+
+    Subclasses set `name`, store the model used when none is given in
+    `default_model_name`, and implement `embed`, receiving a list of strings
+    and returning one vector per string.
+    """
+    name: str = None
+    default_model_name: str = None
+    
+    @abstractmethod
+    def embed(self, model_name: str, texts: List[str]) -> np.typing.ArrayLike:
+        pass
+
+
+class GenerativeBackend(ABC):
+    """
+    Interface of the engines that answer prompts for `GenerativeModel`.
+
+    Subclasses set `name`, store the model used when none is given in
+    `default_model_name`, and implement `generate`, receiving a prompt and
+    returning the generated text.
+    """
+    name: str = None
+    default_model_name: str = None
+    
+    @abstractmethod
+    def generate(self, model_name: str, prompt: str) -> str:
+        pass
+
+
+class OllamaBackend(EmbeddingBackend, GenerativeBackend):
+    """
+    Backend that sends every request over HTTP to a running Ollama daemon.
+
+    The `ollama` client is imported on first use, so the other backends work
+    without it installed.
+
+    Args:
+        default_model_name (str): The model used when `EmbeddingModel` or
+            `GenerativeModel` are not given one.
+
+    Examples:
+        >>> backend = OllamaBackend(default_model_name='mxbai-embed-large')
+        >>> vectors = backend.embed('mxbai-embed-large', ["Cat", "Dog"])
+        >>> print(len(vectors), len(vectors[0]))
+        2 1024
+    """
+    name: str = 'ollama'
+    
+    def __init__(self, default_model_name: str):
+        self.default_model_name: str = default_model_name
+        pass
+    
+    
+    def embed(self, model_name: str, texts: List[str]) -> np.typing.ArrayLike:
+        import ollama
+        embeddings = ollama.embed(model=model_name, input=texts)
+        return embeddings.get('embeddings')
+    
+    
+    def generate(self, model_name: str, prompt: str) -> str:
+        import ollama
+        response = ollama.generate(model=model_name, prompt=prompt)
+        return response.get('response')
+
+
+class SentenceTransformersBackend(EmbeddingBackend):
+    """
+    In-process CPU embedding backend built on `sentence-transformers`.
+
+    Each model is loaded once, on its first use, and then kept in memory, so
+    embedding a query costs no inter-process round trip. The embeddings are
+    L2-normalized, making the retriever's dot product a cosine similarity.
+
+    Examples:
+        >>> backend = SentenceTransformersBackend()
+        >>> vectors = backend.embed('all-MiniLM-L6-v2', ["Cat", "Dog"])
+        >>> print(vectors.shape)
+        (2, 384)
+    """
+    name: str = 'sentence-transformers'
+    
+    def __init__(self, device: str = 'cpu', default_model_name: str = DEFAULT_SENTENCE_TRANSFORMERS_MODEL_NAME):
+        self.device: str = device
+        self.default_model_name: str = default_model_name
+        self.models: Dict[str, Any] = {}
+        pass
+    
+    
+    def load_model(self, model_name: str):
+        if model_name not in self.models:
+            try:
+                from sentence_transformers import SentenceTransformer
+            except ImportError as error:
+                raise ImportError(
+                    "The 'sentence-transformers' backend requires the sentence-transformers package: "
+                    "pip install sentence-transformers"
+                ) from error
+            self.models[model_name] = SentenceTransformer(model_name, device=self.device)
+        return self.models[model_name]
+    
+    
+    def embed(self, model_name: str, texts: List[str]) -> np.typing.ArrayLike:
+        model = self.load_model(model_name)
+        return model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+
+
+class HashingEmbeddingBackend(EmbeddingBackend):
+    """
+    Deterministic embedding backend that hashes lowercase word tokens into a
+    fixed number of signed buckets.
+
+    It needs no model nor daemon and gives the same vectors on every machine
+    and process, which makes it suitable for tests. The vectors carry lexical
+    overlap only, not meaning.
+
+    Examples:
+        >>> backend = HashingEmbeddingBackend(dim=8)
+        >>> print(backend.embed('hashing', ["the cat", "the cat"]).shape)
+        (2, 8)
+    """
+    name: str = 'hashing'
+    
+    def __init__(self, dim: int = DEFAULT_HASHING_EMBEDDING_DIM, default_model_name: str = 'hashing'):
+        self.dim: int = dim
+        self.default_model_name: str = default_model_name
+        pass
+    
+    
+    def embed(self, model_name: str, texts: List[str]) -> np.typing.ArrayLike:
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in re.findall(r'\w+', text.lower()):
+                digest = hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest()
+                value = int.from_bytes(digest, 'little')
+                sign = 1.0 if value & 1 else -1.0
+                embeddings[row, (value >> 1) % self.dim] += sign
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return embeddings / norms
+
+
+EMBEDDING_BACKENDS: Dict[str, Callable[[], EmbeddingBackend]] = {
+    'ollama': partial(OllamaBackend, default_model_name=DEFAULT_EMBEDDING_MODEL_NAME),
+    'sentence-transformers': SentenceTransformersBackend,
+    'hashing': HashingEmbeddingBackend,
+}
+
+GENERATIVE_BACKENDS: Dict[str, Callable[[], GenerativeBackend]] = {
+    'ollama': partial(OllamaBackend, default_model_name=DEFAULT_GENERATIVE_MODEL_NAME),
+}
+
+_backend_instances: Dict[Tuple[str, str], Any] = {}
+
+
+def default_backend_name(kind: Literal['embedding', 'generative']) -> str:
+    """
+    Return the backend selected by the `RAG_EMBEDDING_BACKEND` or
+    `RAG_GENERATIVE_BACKEND` environment variable, or 'ollama' when it is unset.
+
+    Args:
+        kind (Literal['embedding', 'generative']): Which backend to look up.
+
+    Returns:
+        str: The backend name.
+
+    Raises:
+        ValueError: If the environment variable names an unknown backend.
+
+    Examples:
+        >>> os.environ['RAG_EMBEDDING_BACKEND'] = 'hashing'
+        >>> print(default_backend_name('embedding'))
+        hashing
+    """
+    registry = EMBEDDING_BACKENDS if kind == 'embedding' else GENERATIVE_BACKENDS
+    variable = BACKEND_ENVIRONMENT_VARIABLES[kind]
+    backend = os.environ.get(variable) or DEFAULT_BACKEND
+    if backend not in registry:
+        raise ValueError(f'{variable}={backend!r} is not a {kind} backend. Available: {", ".join(registry)}')
+    return backend
+
+
+def embeddings_metadata_path(embeddings_path: os.path) -> os.path:
+    """
+    Return the path of the JSON file that records how an embeddings file was built.
+
+    Examples:
+        >>> print(embeddings_metadata_path('.data/paper_embeddings.npy'))
+        .data/paper_embeddings.json
+    """
+    return os.path.splitext(embeddings_path)[0] + '.json'
+
+
+def get_backend(backend: Union[str, EmbeddingBackend, GenerativeBackend], kind: Literal['embedding', 'generative']):
+    """
+    Resolve a backend name to a shared backend instance.
+
+    Instances are created once per name and reused, so in-process models are
+    loaded a single time however many `EmbeddingModel` objects are created.
+    Backend objects are returned unchanged.
+
+    Args:
+        backend (Union[str, EmbeddingBackend, GenerativeBackend]): A name from
+            `EMBEDDING_BACKENDS` or `GENERATIVE_BACKENDS`, or a backend instance.
+        kind (Literal['embedding', 'generative']): Which registry to look the name up in.
+
+    Returns:
+        The backend instance.
+
+    Examples:
+        >>> backend = get_backend('hashing', 'embedding')
+        >>> print(backend is get_backend('hashing', 'embedding'))
+        True
+    """
+    if not isinstance(backend, str): return backend
+    registry = EMBEDDING_BACKENDS if kind == 'embedding' else GENERATIVE_BACKENDS
+    if backend not in registry:
+        raise ValueError(f'Unknown {kind} backend {backend!r}. Available: {", ".join(registry)}')
+    if (kind, backend) not in _backend_instances:
+        _backend_instances[(kind, backend)] = registry[backend]()
+    return _backend_instances[(kind, backend)]
+
 
 class GenerativeModel:
-    def __init__(self, model_name: str = DEFAULT_GENERATIVE_MODEL_NAME):
+    def __init__(
+        self,
+        model_name: str = None,
+        backend: Union[str, GenerativeBackend] = None
+    ):
         """
         Initialize a wrapper for a generative language model.
 
         Args:
             model_name (str, optional): The name of the generative model to use.
-                Defaults to 'gemma3:4b'.
+                Defaults to the backend's default model ('gemma3:4b' for Ollama).
+            backend (Union[str, GenerativeBackend], optional): The backend that runs
+                the model, by name or instance. Defaults to `default_backend_name('generative')`.
 
         Examples:
             >>> model = GenerativeModel()
@@ -20,7 +265,8 @@ class GenerativeModel:
             >>> print(response)
             "Why did the cat sit on the computer? Because it wanted to keep an eye on the mouse."
         """
-        self.model_name = model_name
+        self.backend: GenerativeBackend = get_backend(backend or default_backend_name('generative'), 'generative')
+        self.model_name = model_name or self.backend.default_model_name
         pass
     
     
@@ -40,19 +286,25 @@ class GenerativeModel:
             >>> print(response)
             "Prince Hamlet seeks revenge for his father's murder, leading to tragedy."
         """
-        response = ollama.generate(model=self.model_name, prompt=prompt)
-        response = response.get('response')
+        response = self.backend.generate(self.model_name, prompt)
         return response
     
 
 class EmbeddingModel:
-    def __init__(self, model_name: str = DEFAULT_EMBEDDING_MODEL_NAME):
+    def __init__(
+        self,
+        model_name: str = None,
+        backend: Union[str, EmbeddingBackend] = None
+    ):
         """
         Initialize a wrapper for an embedding model.
 
         Args:
             model_name (str, optional): The name of the embedding model to use.
-                Defaults to 'mxbai-embed-large'.
+                Defaults to the backend's default model ('mxbai-embed-large' for Ollama).
+            backend (Union[str, EmbeddingBackend], optional): The backend that runs
+                the model, by name or instance: 'ollama', 'sentence-transformers'
+                or 'hashing'. Defaults to `default_backend_name('embedding')`.
 
         Examples:
             >>> embed_model = EmbeddingModel()
@@ -60,10 +312,25 @@ class EmbeddingModel:
             >>> print(vector.shape)
             (1024,)   # Example dimension of the embedding
         """
-        self.model_name = model_name
+        self.backend: EmbeddingBackend = get_backend(backend or default_backend_name('embedding'), 'embedding')
+        self.model_name = model_name or self.backend.default_model_name
         pass
     
     
+    def describe(self) -> Dict[str, str]:
+        """
+        Describe the backend and model, as recorded next to the embeddings they build.
+
+        Returns:
+            Dict[str, str]: The 'backend' name and the 'model_name'.
+
+        Examples:
+            >>> print(EmbeddingModel(backend='hashing').describe())
+            {'backend': 'hashing', 'model_name': 'hashing'}
+        """
+        return {'backend': self.backend.name, 'model_name': self.model_name}
+    
+    
     def embed(self, input_text: Union[str, List[str]]) -> np.typing.ArrayLike:
         """
         Generate vector embeddings for input text using the embedding model.
@@ -89,8 +356,8 @@ class EmbeddingModel:
             >>> print(vectors.shape)
             (3, 1024)
         """
-        embeddings = ollama.embed(model=self.model_name, input=input_text)
-        embeddings = embeddings.get('embeddings')
-        if type(input_text) == str: embeddings = embeddings[0]
+        texts = [input_text] if type(input_text) == str else list(input_text)
+        embeddings = self.backend.embed(self.model_name, texts)
         embeddings = np.array(embeddings, dtype=np.float32)
+        if type(input_text) == str: embeddings = embeddings[0]
         return embeddings
\ No newline at end of file
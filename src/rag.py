@@ -1,5 +1,5 @@
 from llm import GenerativeModel, EmbeddingModel
-from retriever import Retriever
+from retriever import Retriever, ShardedRetriever
 from ingestion import IngestionHandler, ChunkingHandler
 from prompt import Prompt
 
@@ -9,8 +9,21 @@ import os
 
 from typing import *
 
+DEFAULT_CONTEXT = """You are a research assistant. Your role is to help the user analyze the document "{file_name}"."""
+DEFAULT_INSTRUCTIONS = """1. Use **only** the information contained in the text chunks above. 
+2. If the answer is explicitly stated in the chunks, cite the exact line(s) or phrase(s) that support your answer. 
+3. If the answer requires interpretation, provide a short explanation but always ground it by quoting or referring directly to the retrieved lines. 
+4. If the retrieved chunks do not provide enough information to answer the question, respond only with: **"Not found in the provided text chunks."**
+5. Do not use external knowledge or prior training data — rely only on the text chunks above."""
+
 class RAG:
-    def __init__(self, file_name: os.path, dir_name: os.path):
+    def __init__(
+        self,
+        file_name: os.path,
+        dir_name: os.path,
+        embedding_backend: str = None,
+        generative_backend: str = None
+    ):
         self.file_name: os.path = file_name
         self.dir_name: os.path = dir_name
         self.pdf_path: os.path = os.path.join(dir_name, file_name + '.pdf')
@@ -30,6 +43,12 @@ class RAG:
         self.relevant_chunks: List[str] = None
         self.answer: str = None
         
+        # models are created on first use, so steps that do not need them never load them
+        self.embedding_backend: str = embedding_backend
+        self.generative_backend: str = generative_backend
+        self.embedding_model: EmbeddingModel = None
+        self.generative_model: GenerativeModel = None
+        
         self.prompt: Prompt = Prompt()
         pass
     
@@ -41,19 +60,32 @@ class RAG:
         return
     
     
-    def ingest(self):
+    def get_embedding_model(self) -> EmbeddingModel:
+        if self.embedding_model is None:
+            self.embedding_model = EmbeddingModel(backend=self.embedding_backend)
+        return self.embedding_model
+    
+    
+    def get_generative_model(self) -> GenerativeModel:
+        if self.generative_model is None:
+            self.generative_model = GenerativeModel(backend=self.generative_backend)
+        return self.generative_model
+    
+    
+    def ingest(self, extraction_mode: Literal['plain', 'layout'] = 'plain'):
         ingestion_handler = IngestionHandler(path=self.pdf_path)
-        ingestion_handler.extract_raw_text('plain')
+        ingestion_handler.extract_raw_text(extraction_mode)
         self.raw_text = ingestion_handler.raw_text
         ingestion_handler.save_raw_text(self.raw_text_path)
         self.raw_text_extracted = True
     
     
-    def split(self):
-        chunker = ChunkingHandler(raw_text=self.raw_text)
+    def split(self, minimum_chunk_length: int = 500):
+        if self.raw_text is None: chunker = ChunkingHandler(file_path=self.raw_text_path)
+        else: chunker = ChunkingHandler(raw_text=self.raw_text)
         chunker.split()
-        chunker.normalize_lengths()
-        chunker.embed()
+        chunker.normalize_lengths(minimum_chunk_length=minimum_chunk_length)
+        chunker.embed(self.get_embedding_model())
         chunker.save_chunks(self.chunks_path)
         self.chunks = chunker.chunks
         self.chunks_extracted = True
@@ -62,11 +94,27 @@ class RAG:
         self.embeddings_extracted = True
     
     
-    def retrieve(self, query: str):
+    def retrieve(self, query: str, top_k: int = 20, n_shards: int = None):
+        # without an explicit backend the retriever uses the one recorded with the index
+        if self.embedding_backend: embedding_model = self.get_embedding_model()
+        else: embedding_model = self.embedding_model
+        if n_shards:
+            # the embeddings are memory-mapped and searched by worker processes
+            with ShardedRetriever(
+                chunks_path=self.chunks_path,
+                chunks_embeddings_path=self.embeddings_path,
+                top_k=top_k,
+                n_shards=n_shards,
+                embedding_model=embedding_model
+            ) as retriever:
+                retriever.load_chunks()
+                self.relevant_chunks = retriever.search(query)
+            return
         retriever = Retriever(
             chunks_path=self.chunks_path,
             chunks_embeddings_path=self.embeddings_path,
-            top_k=20
+            top_k=top_k,
+            embedding_model=embedding_model
         )
         retriever.load_chunks()
         self.relevant_chunks = retriever.search(query)
@@ -74,37 +122,39 @@ class RAG:
     
     
     def ask_llm(self, query: str = None):
-        generative_model = GenerativeModel()
+        generative_model = self.get_generative_model()
         if query: answer = generative_model.ask(query)
         else: answer = generative_model.ask(self.prompt.compiled_prompt)
         self.answer = answer
 
-rag = RAG(file_name='sample_paper', dir_name='./.data')
 
-rag.get_checkpoints()
-if not rag.raw_text_extracted: rag.ingest()
-else: print('CHECKPOINT: raw text already extracted')
-if not rag.chunks_extracted: rag.split()
-else: print('CHECKPOINT: chunks already extracted')
+if __name__ == '__main__':
+    rag = RAG(file_name='sample_paper', dir_name='./.data')
+
+    rag.get_checkpoints()
+    if not rag.raw_text_extracted: rag.ingest()
+    else: print('CHECKPOINT: raw text already extracted')
+    if not rag.chunks_extracted: rag.split()
+    else: print('CHECKPOINT: chunks already extracted')
 
-rag.retrieve('autoencoder')
+    rag.retrieve('autoencoder')
 
-rag.prompt.set_context(
-    """You are a research assistant specialized in artificial intelligence, medical imaging, and foundation models. 
+    rag.prompt.set_context(
+        """You are a research assistant specialized in artificial intelligence, medical imaging, and foundation models. 
 Your role is to help the user analyze the paper "FOUNDATIONAL MODELS IN MEDICAL IMAGING: A COMPREHENSIVE SURVEY AND FUTURE VISION"."""
-)
-rag.prompt.set_instructions("""1. Use **only** the information contained in the text chunks above. 
+    )
+    rag.prompt.set_instructions("""1. Use **only** the information contained in the text chunks above. 
 2. If the answer is explicitly stated in the chunks, cite the exact line(s) or phrase(s) that support your answer. 
 3. If the answer requires interpretation, provide a short explanation but always ground it by quoting or referring directly to the retrieved lines. 
 4. If the retrieved chunks do not provide enough information to answer the question, respond only with: **"Not found in the provided text chunks."**
 5. Do not use external knowledge or prior training data about the poem — rely only on the text chunks above.""")
 
-rag.prompt.set_chunks(rag.relevant_chunks)
+    rag.prompt.set_chunks(rag.relevant_chunks)
 
-rag.prompt.set_question('What is the purpose of the foundational models in this text?')
-rag.prompt.compile()
+    rag.prompt.set_question('What is the purpose of the foundational models in this text?')
+    rag.prompt.compile()
 
-rag.ask_llm()
+    rag.ask_llm()
 
-print(rag.prompt.compiled_prompt)
-print(rag.answer)
\ No newline at end of file
+    print(rag.prompt.compiled_prompt)
+    print(rag.answer)
@@ -1,11 +1,28 @@
-from llm import EmbeddingModel
+from llm import EmbeddingModel, embeddings_metadata_path
+from multiprocessing import Pool
 from typing import *
 import numpy as np
 import pandas as pd
+import heapq
+import contextlib
+import warnings
+import json
+import time
 import os
 
+DEFAULT_SCORE_BLOCK_ROWS = 4096
+
+
 class Retriever:
-    def __init__(self, chunks_path: os.path, chunks_embeddings_path: os.path, top_k: int = 10):
+    def __init__(
+        self,
+        chunks_path: os.path,
+        chunks_embeddings_path: os.path,
+        top_k: int = 10,
+        embedding_model: EmbeddingModel = None,
+        block_rows: int = DEFAULT_SCORE_BLOCK_ROWS,
+        blas_threads: int = None
+    ):
         """
         Initialize a retriever for performing similarity search over precomputed embeddings.
 
@@ -15,6 +32,16 @@ class Retriever:
                 precomputed embeddings for the chunks.
             top_k (int, optional): Number of top relevant chunks to return during search.
                 Defaults to 10.
+            embedding_model (EmbeddingModel, optional): The model used to embed queries.
+                It must be the one the chunk embeddings were built with. Defaults to the
+                backend and model recorded next to the embeddings, or to `EmbeddingModel()`
+                when there is no record, created on the first search.
+            block_rows (int, optional): Number of embedding rows scored per matrix
+                product. Scores are always computed over the same row blocks, so
+                `ShardedRetriever` reproduces them bit for bit. Defaults to 4096.
+            blas_threads (int, optional): Maximum number of BLAS threads used while
+                scoring. Needs the optional `threadpoolctl` package. Defaults to None,
+                which leaves the BLAS library's own setting.
 
         Examples:
             >>> retriever = Retriever("chunks.csv", "embeddings.npy", top_k=5)
@@ -23,8 +50,12 @@ class Retriever:
         self.chunks_path: os.path = chunks_path
         self.chunks_embeddings_path: os.path = chunks_embeddings_path
         self.top_k: int = top_k
+        self.embedding_model: EmbeddingModel = embedding_model
+        self.block_rows: int = block_rows
+        self.blas_threads: int = blas_threads
         self.chunks: List[str] = None
         self.chunk_embeddings = None
+        self.embeddings_metadata: Dict[str, Any] = None
         pass
     
     
@@ -47,15 +78,44 @@ class Retriever:
              "Neural networks are used in deep learning ...",
              "Applications of deep learning include image recognition ..."]
         """
-        embedding_model = EmbeddingModel()
-        query_embedding = embedding_model.embed(query)
-        scores = np.linalg.matmul(self.chunk_embeddings, query_embedding)
-        top_k_indexes = np.argpartition(scores, -self.top_k)[-self.top_k:]
-        top_k_indexes = np.sort(top_k_indexes)[::-1]
+        if self.embedding_model is None and self.embeddings_metadata is not None:
+            self.embedding_model = EmbeddingModel(
+                model_name=self.embeddings_metadata.get('model_name'),
+                backend=self.embeddings_metadata.get('backend')
+            )
+        elif self.embedding_model is None:
+            self.embedding_model = EmbeddingModel()
+        query_embedding = self.embedding_model.embed(query)
+        top_k_indexes = self.search_embedding(query_embedding)
         relevant_chunks = [self.chunks[index] for index in top_k_indexes]
         return relevant_chunks
     
     
+    def search_embedding(self, query_embedding: np.typing.ArrayLike) -> List[int]:
+        """
+        Retrieve the indexes of the most relevant chunks for an already embedded query.
+
+        Args:
+            query_embedding (np.typing.ArrayLike): The 1D embedding of the query.
+
+        Returns:
+            List[int]: The top-k chunk indexes, ordered by descending score and,
+                for equal scores, by ascending index.
+
+        Examples:
+            >>> retriever = Retriever("chunks.csv", "embeddings.npy", top_k=3)
+            >>> retriever.load_chunks()
+            >>> print(retriever.search_embedding(np.ones(1024, dtype=np.float32)))
+            [42, 7, 105]
+        """
+        query_embedding = self._check_query_embedding(query_embedding)
+        with _limit_blas_threads(self.blas_threads):
+            scores, indexes = _shard_top_k(
+                self.chunk_embeddings, query_embedding, self.top_k, 0, len(self.chunk_embeddings), self.block_rows
+            )
+        return indexes.tolist()
+    
+    
     def load_chunks(self):
         """
         Load text chunks and their embeddings from disk.
@@ -73,5 +133,385 @@ class Retriever:
         chunks = pd.read_csv(self.chunks_path)
         chunks = chunks['chunk_str'].to_list()
         self.chunks = chunks
+        self._load_embeddings_metadata()
+        return
+    
+    
+    def check_embedding_model(self):
+        """
+        Check that `embedding_model` is the backend and model that built the embeddings.
+
+        The check uses the `.json` file written next to the embeddings by
+        `ChunkingHandler.save_embeddings`; embeddings saved without it are not checked.
+
+        Raises:
+            ValueError: If the backend or the model name differ from the recorded ones.
+
+        Examples:
+            >>> retriever = Retriever("chunks.csv", "embeddings.npy")
+            >>> retriever.load_chunks()
+            >>> retriever.embedding_model = EmbeddingModel(backend='hashing')
+            >>> retriever.check_embedding_model()
+            ValueError: The embeddings in embeddings.npy were built with backend 'ollama' ...
+        """
+        if self.embeddings_metadata is None or self.embedding_model is None: return
+        built_with = {key: self.embeddings_metadata.get(key) for key in ['backend', 'model_name']}
+        if built_with != self.embedding_model.describe():
+            raise ValueError(
+                f'The embeddings in {self.chunks_embeddings_path} were built with backend '
+                f'{built_with["backend"]!r} and model {built_with["model_name"]!r}, but the retriever uses '
+                f'backend {self.embedding_model.backend.name!r} and model {self.embedding_model.model_name!r}. '
+                f'Select the same backend or split the document again.'
+            )
+        return
+    
+    
+    def _load_embeddings_metadata(self):
+        metadata_path = embeddings_metadata_path(self.chunks_embeddings_path)
+        self.embeddings_metadata = None
+        if os.path.exists(metadata_path):
+            with open(metadata_path, mode='r', encoding='utf-8') as file:
+                self.embeddings_metadata = json.load(file)
+        self.check_embedding_model()
+        return
+    
+    
+    def _check_query_embedding(self, query_embedding: np.typing.ArrayLike) -> np.ndarray:
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+        if query_embedding.shape != self.chunk_embeddings.shape[1:]:
+            raise ValueError(
+                f'The query embedding has shape {query_embedding.shape}, but the embeddings in '
+                f'{self.chunks_embeddings_path} have dimension {self.chunk_embeddings.shape[1]}. '
+                f'They were probably built with a different embedding model.'
+            )
+        return query_embedding
+
+
+class ShardedRetriever(Retriever):
+    def __init__(
+        self,
+        chunks_path: os.path,
+        chunks_embeddings_path: os.path,
+        top_k: int = 10,
+        n_shards: int = 4,
+        n_workers: int = None,
+        embedding_model: EmbeddingModel = None,
+        block_rows: int = DEFAULT_SCORE_BLOCK_ROWS,
+        blas_threads: int = 1
+    ):
+        """
+        Initialize a retriever that splits the embedding matrix into row shards
+        searched in parallel by worker processes.
+
+        Workers memory-map the `.npy` file instead of receiving a copy of the
+        matrix, so every process shares the same pages of the OS cache. Each
+        shard returns a partial top-k and the partial results are merged with
+        a heap. Shards are cut on multiples of `block_rows` and scored block by
+        block exactly like `Retriever.search_embedding`, so both return the same
+        indexes, ties included, when they use the same `blas_threads`.
+
+        An index with fewer than `n_shards` blocks gets one shard per block, and
+        no more workers are started than there are shards.
+
+        Args:
+            chunks_path (os.path): Path to the CSV file containing text chunks.
+            chunks_embeddings_path (os.path): Path to the NumPy `.npy` file containing
+                precomputed embeddings for the chunks.
+            top_k (int, optional): Number of top relevant chunks to return during search.
+                Defaults to 10.
+            n_shards (int, optional): Number of row shards the embedding matrix is
+                split into. Defaults to 4.
+            n_workers (int, optional): Number of worker processes, capped at the
+                number of shards. Defaults to `min(n_shards, os.cpu_count())`.
+            embedding_model (EmbeddingModel, optional): The model used to embed queries.
+                Defaults to the backend and model recorded next to the embeddings.
+            block_rows (int, optional): Number of embedding rows scored per matrix
+                product. Defaults to 4096.
+            blas_threads (int, optional): Maximum number of BLAS threads in each worker,
+                so that workers do not oversubscribe the cores. Needs the optional
+                `threadpoolctl` package. Defaults to 1.
+
+        Examples:
+            >>> with ShardedRetriever("chunks.csv", "embeddings.npy", top_k=5, n_shards=8) as retriever:
+            ...     retriever.load_chunks()
+            ...     results = retriever.search("What is deep learning?")
+        """
+        super().__init__(chunks_path, chunks_embeddings_path, top_k, embedding_model, block_rows, blas_threads)
+        self.n_shards: int = n_shards
+        self.n_workers: int = n_workers or min(n_shards, os.cpu_count() or 1)
+        self.shard_bounds: List[Tuple[int, int]] = None
+        self.pool = None
+        pass
+    
+    
+    def load_chunks(self):
+        """
+        Load text chunks, memory-map the embeddings and start the worker pool.
+
+        Examples:
+            >>> retriever = ShardedRetriever("chunks.csv", "embeddings.npy", n_shards=4)
+            >>> retriever.load_chunks()
+            >>> print(retriever.shard_bounds)
+            [(0, 8192), (8192, 16384), (16384, 24576), (24576, 30000)]
+        """
+        self.chunk_embeddings = np.load(self.chunks_embeddings_path, mmap_mode='r')
+        chunks = pd.read_csv(self.chunks_path)
+        chunks = chunks['chunk_str'].to_list()
+        self.chunks = chunks
+        self._load_embeddings_metadata()
+        
+        n_rows = len(self.chunk_embeddings)
+        n_blocks = -(-n_rows // self.block_rows)
+        block_boundaries = np.linspace(0, n_blocks, self.n_shards + 1).astype(int)
+        boundaries = np.minimum(block_boundaries * self.block_rows, n_rows)
+        self.shard_bounds = [
+            (int(start), int(end)) for start, end in zip(boundaries[:-1], boundaries[1:]) if end > start
+        ]
+        if self.n_shards > len(self.shard_bounds):
+            warnings.warn(
+                f'{n_rows} rows make {n_blocks} blocks of {self.block_rows} rows, so the index is split into '
+                f'{len(self.shard_bounds)} shards instead of {self.n_shards}. Lower block_rows to split it further.'
+            )
+        self.n_workers = max(1, min(self.n_workers, len(self.shard_bounds)))
+        if self.blas_threads is not None and not _has_threadpoolctl():
+            warnings.warn('threadpoolctl is not installed, so the workers use the default number of BLAS threads.')
+        
+        self.close()
+        self.pool = Pool(
+            processes=self.n_workers,
+            initializer=_init_shard_worker,
+            initargs=(self.chunks_embeddings_path, self.blas_threads)
+        )
+        return
+    
+    
+    def search_embedding(self, query_embedding: np.typing.ArrayLike) -> List[int]:
+        """
+        Fan the query out to every shard and merge the partial top-k results.
+
+        Args:
+            query_embedding (np.typing.ArrayLike): The 1D embedding of the query.
+
+        Returns:
+            List[int]: The top-k chunk indexes, ordered by descending score and,
+                for equal scores, by ascending index.
+
+        Examples:
+            >>> retriever = ShardedRetriever("chunks.csv", "embeddings.npy", top_k=3)
+            >>> retriever.load_chunks()
+            >>> print(retriever.search_embedding(np.ones(1024, dtype=np.float32)))
+            [42, 7, 105]
+        """
+        if self.pool is None:
+            raise RuntimeError('The worker pool is not running; call load_chunks() before searching.')
+        query_embedding = self._check_query_embedding(query_embedding)
+        tasks = [
+            (start, end, query_embedding, self.top_k, self.block_rows) for start, end in self.shard_bounds
+        ]
+        partial_results = self.pool.map(_search_shard, tasks)
+        
+        partial_results = [
+            zip((-scores).tolist(), indexes.tolist()) for scores, indexes in partial_results
+        ]
+        merged = heapq.merge(*partial_results)
+        top_k_indexes = [index for _, index in merged][:self.top_k]
+        return top_k_indexes
+    
+    
+    def close(self):
+        """
+        Stop the worker pool, if it is running.
+
+        Examples:
+            >>> retriever = ShardedRetriever("chunks.csv", "embeddings.npy")
+            >>> retriever.load_chunks()
+            >>> retriever.close()
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        return
+    
+    
+    def __enter__(self):
+        return self
+    
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return
+    
+    
+    def __del__(self):
+        if getattr(self, 'pool', None) is not None:
+            self.pool.terminate()
+            self.pool = None
+        return
+
+
+def benchmark_sharded_search(
+    chunks_path: os.path,
+    chunks_embeddings_path: os.path,
+    shard_counts: List[int] = None,
+    worker_counts: List[int] = None,
+    n_queries: int = 100,
+    top_k: int = 10,
+    seed: int = 0,
+    block_rows: int = DEFAULT_SCORE_BLOCK_ROWS,
+    blas_threads: int = 1
+) -> pd.DataFrame:
+    """
+    Measure sharded search throughput for every combination of shard and worker counts.
+
+    Random query vectors are used so the measurement does not include the
+    embedding model. Every sharded result is compared with the single-process
+    exact search over the same queries, run with the same `blas_threads`.
+    The report gives the shard and worker counts actually used, which are lower
+    than the requested ones when the index has fewer blocks than shards.
+
+    Args:
+        chunks_path (os.path): Path to the CSV file containing text chunks.
+        chunks_embeddings_path (os.path): Path to the NumPy `.npy` embeddings file.
+        shard_counts (List[int], optional): Shard counts to measure. Defaults to [1, 2, 4, 8].
+        worker_counts (List[int], optional): Worker process counts to measure.
+            Defaults to one worker per shard.
+        n_queries (int, optional): Number of queries per configuration. Defaults to 100.
+        top_k (int, optional): Number of results per query. Defaults to 10.
+        seed (int, optional): Seed of the random query vectors. Defaults to 0.
+        block_rows (int, optional): Number of embedding rows scored per matrix
+            product. Defaults to 4096.
+        blas_threads (int, optional): Maximum number of BLAS threads per worker.
+            Defaults to 1.
+
+    Returns:
+        pd.DataFrame: One row per configuration with the columns 'requested_shards',
+            'n_shards', 'n_workers', 'blas_threads' (as reported by the workers,
+            None without `threadpoolctl`), 'cores', 'queries_per_second' and
+            'matches_exact'.
+
+    Examples:
+        >>> report = benchmark_sharded_search("chunks.csv", "embeddings.npy", [1, 4], [1, 4])
+        >>> print(report)
+           requested_shards  n_shards  n_workers  blas_threads  cores  queries_per_second  matches_exact
+        0                 1         1          1             1      8               812.4           True
+        ...
+    """
+    shard_counts = shard_counts or [1, 2, 4, 8]
+    exact_retriever = Retriever(
+        chunks_path, chunks_embeddings_path, top_k=top_k, block_rows=block_rows, blas_threads=blas_threads
+    )
+    exact_retriever.load_chunks()
+    
+    rng = np.random.default_rng(seed)
+    embedding_dim = exact_retriever.chunk_embeddings.shape[1]
+    queries = rng.standard_normal((n_queries, embedding_dim)).astype(np.float32)
+    expected = [exact_retriever.search_embedding(query) for query in queries]
+    
+    rows = []
+    for n_shards in shard_counts:
+        for n_workers in (worker_counts or [n_shards]):
+            retriever = ShardedRetriever(
+                chunks_path,
+                chunks_embeddings_path,
+                top_k=top_k,
+                n_shards=n_shards,
+                n_workers=n_workers,
+                block_rows=block_rows,
+                blas_threads=blas_threads
+            )
+            with retriever:
+                retriever.load_chunks()
+                retriever.search_embedding(queries[0])  # warm up the workers
+                start_time = time.perf_counter()
+                results = [retriever.search_embedding(query) for query in queries]
+                elapsed_time = time.perf_counter() - start_time
+                worker_blas_threads = retriever.pool.apply(_blas_thread_count)
+            rows.append({
+                'requested_shards': n_shards,
+                'n_shards': len(retriever.shard_bounds),
+                'n_workers': retriever.n_workers,
+                'blas_threads': worker_blas_threads,
+                'cores': os.cpu_count(),
+                'queries_per_second': n_queries / elapsed_time,
+                'matches_exact': results == expected
+            })
+    return pd.DataFrame(rows)
+
+
+def _score_rows(
+    embeddings: np.typing.ArrayLike,
+    query_embedding: np.typing.ArrayLike,
+    start: int,
+    end: int,
+    block_rows: int
+) -> np.ndarray:
+    # BLAS may round a row's dot product differently depending on the height of
+    # the matrix it belongs to, so rows are always scored in the same blocks,
+    # aligned to multiples of `block_rows`, whichever process scores them.
+    scores = [
+        np.linalg.matmul(embeddings[block_start:min(block_start + block_rows, end)], query_embedding)
+        for block_start in range(start, end, block_rows)
+    ]
+    return np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)
+
+
+def _shard_top_k(
+    embeddings: np.typing.ArrayLike,
+    query_embedding: np.typing.ArrayLike,
+    top_k: int,
+    start: int,
+    end: int,
+    block_rows: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    # Rows tied with the k-th score are filled in by ascending index, so a shard's
+    # partial top-k never depends on how argpartition orders ties.
+    scores = _score_rows(embeddings, query_embedding, start, end, block_rows)
+    top_k = min(top_k, len(scores))
+    if top_k == 0: return scores[:0], np.arange(0)
+    threshold = np.partition(scores, -top_k)[-top_k]
+    above = np.flatnonzero(scores > threshold)
+    tied = np.flatnonzero(scores == threshold)[:top_k - len(above)]
+    candidates = np.concatenate([above, tied])
+    order = np.lexsort((candidates, -scores[candidates]))
+    top_k_indexes = candidates[order]
+    return scores[top_k_indexes], top_k_indexes + start
+
+
+def _has_threadpoolctl() -> bool:
+    try:
+        import threadpoolctl
+    except ImportError:
+        return False
+    return True
+
+
+def _limit_blas_threads(blas_threads: int):
+    if blas_threads is None or not _has_threadpoolctl(): return contextlib.nullcontext()
+    from threadpoolctl import threadpool_limits
+    return threadpool_limits(limits=blas_threads, user_api='blas')
+
+
+def _blas_thread_count() -> int:
+    if not _has_threadpoolctl(): return None
+    from threadpoolctl import threadpool_info
+    thread_counts = [pool['num_threads'] for pool in threadpool_info() if pool['user_api'] == 'blas']
+    return max(thread_counts) if thread_counts else None
+
+
+_worker_embeddings = None
+_worker_blas_limits = None
+
+
+def _init_shard_worker(chunks_embeddings_path: os.path, blas_threads: int):
+    global _worker_embeddings, _worker_blas_limits
+    # the limit is kept for the whole life of the worker
+    _worker_blas_limits = _limit_blas_threads(blas_threads)
+    _worker_blas_limits.__enter__()
+    _worker_embeddings = np.load(chunks_embeddings_path, mmap_mode='r')
+    return
 
 
+def _search_shard(task: Tuple[int, int, np.ndarray, int, int]) -> Tuple[np.ndarray, np.ndarray]:
+    start, end, query_embedding, top_k, block_rows = task
+    return _shard_top_k(_worker_embeddings, query_embedding, top_k, start, end, block_rows)
@@ -0,0 +1,34 @@
+from llm import EmbeddingBackend, EmbeddingModel, HashingEmbeddingBackend, default_backend_name
+import numpy as np
+import pytest
+
+
+def test_hashing_embeddings_are_deterministic_and_normalized():
+    embedding_model = EmbeddingModel(backend='hashing')
+    vectors = embedding_model.embed(['the cat sat', 'the cat sat', ''])
+    assert vectors.shape == (3, 384)
+    assert np.array_equal(vectors[0], vectors[1])
+    assert np.isclose(np.linalg.norm(vectors[0]), 1.0)
+    assert not vectors[2].any()
+    assert embedding_model.embed('the cat sat').shape == (384,)
+
+
+def test_hashing_dimension():
+    vectors = HashingEmbeddingBackend(dim=8).embed('hashing', ['one two three'])
+    assert vectors.shape == (1, 8)
+
+
+def test_unknown_backend_in_environment(monkeypatch):
+    monkeypatch.setenv('RAG_EMBEDDING_BACKEND', 'olama')
+    with pytest.raises(ValueError, match='RAG_EMBEDDING_BACKEND'):
+        default_backend_name('embedding')
+    with pytest.raises(ValueError, match='RAG_EMBEDDING_BACKEND'):
+        EmbeddingModel()
+
+
+def test_incomplete_backend_cannot_be_created():
+    class IncompleteBackend(EmbeddingBackend):
+        name = 'incomplete'
+    
+    with pytest.raises(TypeError):
+        IncompleteBackend()
@@ -0,0 +1,112 @@
+from ingestion import ChunkingHandler
+from llm import EmbeddingModel
+from retriever import Retriever, ShardedRetriever
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def tied_index(tmp_path):
+    # Small integer vectors give many exactly equal scores.
+    rng = np.random.default_rng(0)
+    embeddings = rng.integers(-1, 2, size=(23, 6)).astype(np.float32)
+    chunks_path = tmp_path / 'index_chunks.csv'
+    embeddings_path = tmp_path / 'index_embeddings.npy'
+    pd.DataFrame({'chunk_str': [f'chunk {index}' for index in range(len(embeddings))]}).to_csv(chunks_path)
+    np.save(embeddings_path, embeddings)
+    queries = rng.integers(-1, 2, size=(20, 6)).astype(np.float32)
+    return str(chunks_path), str(embeddings_path), queries
+
+
+@pytest.mark.parametrize('top_k', [1, 5, 30])
+def test_exact_search_orders_by_score_then_index(tied_index, top_k):
+    chunks_path, embeddings_path, queries = tied_index
+    retriever = Retriever(chunks_path, embeddings_path, top_k=top_k, block_rows=4)
+    retriever.load_chunks()
+    for query in queries:
+        scores = retriever.chunk_embeddings @ query
+        expected = sorted(range(len(scores)), key=lambda index: (-scores[index], index))[:top_k]
+        assert retriever.search_embedding(query) == expected
+
+
+@pytest.mark.parametrize('n_shards', [1, 2, 3, 5, 6])
+@pytest.mark.parametrize('top_k', [1, 5, 30])
+def test_sharded_search_matches_exact_search(tied_index, n_shards, top_k):
+    chunks_path, embeddings_path, queries = tied_index
+    exact_retriever = Retriever(chunks_path, embeddings_path, top_k=top_k, block_rows=4, blas_threads=1)
+    exact_retriever.load_chunks()
+    with ShardedRetriever(
+        chunks_path, embeddings_path, top_k=top_k, n_shards=n_shards, n_workers=2, block_rows=4
+    ) as retriever:
+        retriever.load_chunks()
+        for query in queries:
+            assert retriever.search_embedding(query) == exact_retriever.search_embedding(query)
+
+
+def test_shards_and_workers_are_capped_at_the_number_of_blocks(tied_index):
+    chunks_path, embeddings_path, queries = tied_index
+    with ShardedRetriever(chunks_path, embeddings_path, n_shards=8, n_workers=8, block_rows=4) as retriever:
+        with pytest.warns(UserWarning, match='6 shards instead of 8'):
+            retriever.load_chunks()
+        assert len(retriever.shard_bounds) == 6
+        assert retriever.n_workers == 6
+
+
+def test_sharded_search_requires_load_chunks(tied_index):
+    chunks_path, embeddings_path, queries = tied_index
+    retriever = ShardedRetriever(chunks_path, embeddings_path)
+    with pytest.raises(RuntimeError, match='load_chunks'):
+        retriever.search_embedding(queries[0])
+
+
+@pytest.fixture
+def hashing_index(tmp_path):
+    raw_text = '\n'.join([
+        'Venus courts Adonis in the morning light.',
+        'The boar hides in the dark forest.',
+        'Horses gallop across the open meadow.',
+    ])
+    chunker = ChunkingHandler(raw_text=raw_text)
+    chunker.split()
+    chunker.embed(EmbeddingModel(backend='hashing'))
+    chunks_path = tmp_path / 'poem_chunks.csv'
+    embeddings_path = tmp_path / 'poem_embeddings.npy'
+    chunker.save_chunks(chunks_path)
+    chunker.save_embeddings(embeddings_path)
+    return str(chunks_path), str(embeddings_path)
+
+
+def test_search_with_hashing_backend(hashing_index):
+    chunks_path, embeddings_path = hashing_index
+    retriever = Retriever(chunks_path, embeddings_path, top_k=1, embedding_model=EmbeddingModel(backend='hashing'))
+    retriever.load_chunks()
+    assert retriever.search('where does the boar hide?') == ['The boar hides in the dark forest.']
+
+
+def test_search_defaults_to_recorded_backend(hashing_index, monkeypatch):
+    monkeypatch.setenv('RAG_EMBEDDING_BACKEND', 'ollama')
+    chunks_path, embeddings_path = hashing_index
+    retriever = Retriever(chunks_path, embeddings_path, top_k=1)
+    retriever.load_chunks()
+    assert retriever.search('galloping horses') == ['Horses gallop across the open meadow.']
+
+
+def test_load_chunks_rejects_other_embedding_model(hashing_index):
+    chunks_path, embeddings_path = hashing_index
+    embedding_model = EmbeddingModel(backend='hashing', model_name='other-model')
+    retriever = Retriever(chunks_path, embeddings_path, embedding_model=embedding_model)
+    with pytest.raises(ValueError, match="built with backend 'hashing' and model 'hashing'"):
+        retriever.load_chunks()
+
+
+def test_save_embeddings_without_embedding_model(tmp_path):
+    embeddings_path = tmp_path / 'manual_embeddings.npy'
+    metadata_path = tmp_path / 'manual_embeddings.json'
+    metadata_path.write_text('{"backend": "hashing", "model_name": "hashing", "dim": 2}')
+    chunker = ChunkingHandler(raw_text='a\nb')
+    chunker.split()
+    chunker.chunk_embeddings = np.eye(2, dtype=np.float32)
+    chunker.save_embeddings(embeddings_path)
+    assert embeddings_path.exists()
+    assert not metadata_path.exists()